@@ -1,12 +1,16 @@
 """
 Airflow DAG for Automated Model Retraining
 Triggers when drift is detected
+
+Ingest and retrain tasks run in the `retrain_cpu` pool so concurrent DAG runs
+never retrain at the same time. Create it once with:
+    airflow pools set retrain_cpu 1 "Serialize model retraining"
 """
 
 from datetime import datetime, timedelta
 from airflow import DAG
-from airflow.operators.python import PythonOperator
-from airflow.operators.bash import BashOperator
+from airflow.decorators import task
+from airflow.operators.python import ShortCircuitOperator
 from pathlib import Path
 import sys
 import os
@@ -20,6 +24,9 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Pool that caps concurrent retrains across DAG runs
+RETRAIN_POOL = 'retrain_cpu'
+
 # Default arguments
 default_args = {
     'owner': 'mlops',
@@ -42,8 +49,8 @@ dag = DAG(
 )
 
 
-def check_retrain_trigger(**context):
-    """Check if retraining should be triggered"""
+def check_retrain_trigger():
+    """Check if retraining should be triggered (downstream tasks are skipped if not)"""
     trigger_file = Path(__file__).parent.parent.parent / "airflow" / "trigger_retrain.flag"
     
     if trigger_file.exists():
@@ -55,7 +62,8 @@ def check_retrain_trigger(**context):
         return False
 
 
-def get_latest_month(**context):
+@task
+def get_latest_month():
     """Get the latest month for retraining"""
     from datetime import datetime
     # Get current month or previous month
@@ -70,9 +78,9 @@ def get_latest_month(**context):
     return month
 
 
-def ingest_new_data(**context):
+@task(pool=RETRAIN_POOL, pool_slots=1)
+def ingest_new_data(month: str):
     """Ingest new data for retraining"""
-    month = context['ti'].xcom_pull(task_ids='get_latest_month')
     logger.info(f"Ingesting data for month: {month}")
     
     df = ingest_data(month, save_processed=True)
@@ -81,53 +89,33 @@ def ingest_new_data(**context):
     return month
 
 
-def retrain_model(**context):
+@task(pool=RETRAIN_POOL, pool_slots=1)
+def retrain_model(month: str):
     """Retrain the model with new data"""
-    month = context['ti'].xcom_pull(task_ids='ingest_new_data')
     logger.info(f"Retraining model with data from month: {month}")
     
     train_main(month)
     logger.info("Model retraining complete!")
 
 
-def update_serving_model(**context):
+@task
+def update_serving_model():
     """Update the serving model (reload from MLflow)"""
     logger.info("Model updated in MLflow. Serving API will load latest version on next restart.")
     # In production, you might want to restart the serving container here
     return True
 
 
-# Task definitions
-check_trigger_task = PythonOperator(
-    task_id='check_retrain_trigger',
-    python_callable=check_retrain_trigger,
-    dag=dag,
-)
-
-get_month_task = PythonOperator(
-    task_id='get_latest_month',
-    python_callable=get_latest_month,
-    dag=dag,
-)
-
-ingest_task = PythonOperator(
-    task_id='ingest_new_data',
-    python_callable=ingest_new_data,
-    dag=dag,
-)
-
-train_task = PythonOperator(
-    task_id='retrain_model',
-    python_callable=retrain_model,
-    dag=dag,
-)
-
-update_serving_task = PythonOperator(
-    task_id='update_serving_model',
-    python_callable=update_serving_model,
-    dag=dag,
-)
-
-# Task dependencies
-check_trigger_task >> get_month_task >> ingest_task >> train_task >> update_serving_task
-
+# Task definitions and dependencies
+with dag:
+    check_trigger_task = ShortCircuitOperator(
+        task_id='check_retrain_trigger',
+        python_callable=check_retrain_trigger,
+    )
+    
+    month = get_latest_month()
+    ingested_month = ingest_new_data(month)
+    train_task = retrain_model(ingested_month)
+    
+    check_trigger_task >> month
+    train_task >> update_serving_model()
@@ -4,22 +4,36 @@ Downloads and preprocesses data for model training
 """
 
 import os
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import yaml
+from functools import lru_cache
+from types import MappingProxyType
 from datetime import datetime
+from typing import List, Optional, Union
 import logging
 
+from features import trip_duration_minutes, temporal_features
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# Parallel download settings
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+
+@lru_cache(maxsize=1)
 def load_config():
-    """Load configuration from config.yaml"""
+    """Load configuration from config.yaml (parsed once per process, read-only)"""
     config_path = Path(__file__).parent.parent / "config.yaml"
     with open(config_path, 'r') as f:
-        return yaml.safe_load(f)
+        return MappingProxyType(yaml.safe_load(f))
 
 
 def download_nyc_taxi_data(month: str, data_dir: str = "data") -> str:
@@ -50,95 +64,250 @@ def download_nyc_taxi_data(month: str, data_dir: str = "data") -> str:
         return filepath
     
     logger.info(f"Downloading data from {url}")
+    tmp_path = f"{filepath}.part"
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
+        try:
+            head = requests.head(url, allow_redirects=True, timeout=30)
+            head.raise_for_status()
+            content_length = int(head.headers.get('Content-Length', 0))
+            accepts_ranges = head.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        except requests.exceptions.RequestException as e:
+            # Some hosts reject HEAD but still serve GET
+            logger.warning(f"HEAD request failed ({e}), falling back to a single GET")
+            content_length, accepts_ranges = 0, False
         
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        if content_length > 0 and accepts_ranges and hasattr(os, 'pwrite'):
+            _download_ranges(url, tmp_path, content_length)
+        else:
+            _download_stream(url, tmp_path)
         
+        # Only expose the file once it is complete
+        os.replace(tmp_path, filepath)
         logger.info(f"Successfully downloaded {filename}")
         return filepath
     except requests.exceptions.RequestException as e:
         logger.error(f"Error downloading data: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         raise
 
 
-def preprocess_data(filepath: str) -> pd.DataFrame:
+def _download_stream(url: str, filepath: str):
+    """Download a file over a single streaming GET request"""
+    response = requests.get(url, stream=True, timeout=60)
+    response.raise_for_status()
+    
+    with open(filepath, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            f.write(chunk)
+
+
+def _fetch_range(url: str, fd: int, start: int, end: int):
+    """Fetch bytes [start, end] of a URL and write them at the same offset of fd"""
+    response = requests.get(url, headers={'Range': f'bytes={start}-{end}'}, stream=True, timeout=60)
+    response.raise_for_status()
+    if response.status_code != 206:
+        raise requests.exceptions.RequestException(f"Server ignored range request for {url}")
+    
+    offset = start
+    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+        os.pwrite(fd, chunk, offset)
+        offset += len(chunk)
+    
+    if offset != end + 1:
+        raise requests.exceptions.RequestException(
+            f"Incomplete range {start}-{end}: received {offset - start} bytes"
+        )
+
+
+def _download_ranges(url: str, filepath: str, content_length: int):
+    """Download a file with concurrent HTTP range requests"""
+    range_size = -(-content_length // DOWNLOAD_WORKERS)
+    ranges = [
+        (start, min(start + range_size, content_length) - 1)
+        for start in range(0, content_length, range_size)
+    ]
+    
+    fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, content_length)
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            futures = [executor.submit(_fetch_range, url, fd, start, end) for start, end in ranges]
+            for future in futures:
+                future.result()
+    finally:
+        os.close(fd)
+
+
+# Raw columns read from the parquet file (both naming schemes are accepted)
+RAW_COLUMNS = [
+    'lpep_pickup_datetime',
+    'lpep_dropoff_datetime',
+    'pickup_datetime',
+    'dropoff_datetime',
+    'trip_distance',
+    'passenger_count',
+    'PULocationID',
+    'DOLocationID'
+]
+
+# Number of rows decoded per parquet record batch
+BATCH_SIZE = 200_000
+
+# Valid TLC taxi zone IDs
+LOCATION_IDS = range(1, 266)
+
+# Smallest dtypes that hold each processed column
+# (location IDs go up to 265, temporal fields and passenger counts fit in a byte)
+PROCESSED_DTYPES = {
+    'trip_distance': 'float32',
+    'passenger_count': 'uint8',
+    'hour': 'uint8',
+    'day_of_week': 'uint8',
+    'month': 'uint8',
+    'pickup_location_id': 'uint16',
+    'dropoff_location_id': 'uint16',
+    'trip_duration_minutes': 'float32'
+}
+
+
+# Format of string timestamps in older TLC extracts
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _to_datetime64(series: pd.Series) -> np.ndarray:
+    """
+    Convert a timestamp column to a datetime64[ns] array
+    
+    Parquet timestamps are already datetime64 and are only unit-normalized;
+    strings are parsed with an explicit format instead of per-row inference.
+    """
+    if not pd.api.types.is_datetime64_any_dtype(series):
+        series = pd.to_datetime(series, format=DATETIME_FORMAT, cache=True)
+    return series.to_numpy(dtype='datetime64[ns]')
+
+
+def _preprocess_batch(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Filter and engineer features for a single batch of raw trip records
+    
+    All validity checks are combined into one boolean mask so the batch is
+    materialized only once.
+    
+    Args:
+        df: Raw trip records
+        
+    Returns:
+        Batch with derived feature columns
+    """
+    pickup_col = 'lpep_pickup_datetime' if 'lpep_pickup_datetime' in df.columns else 'pickup_datetime'
+    dropoff_col = 'lpep_dropoff_datetime' if 'lpep_dropoff_datetime' in df.columns else 'dropoff_datetime'
+    
+    # Convert pickup/dropoff datetime
+    pickup = _to_datetime64(df[pickup_col])
+    dropoff = _to_datetime64(df[dropoff_col])
+    
+    # Calculate trip duration in minutes from the raw nanosecond values
+    # (rows with missing timestamps are removed by the mask below)
+    duration = trip_duration_minutes(pickup.view('i8'), dropoff.view('i8'))
+    
+    distance = df['trip_distance'].to_numpy()
+    passengers = df['passenger_count'].to_numpy()
+    
+    # Filter out invalid data and unrealistic trip durations (0-180 minutes)
+    mask = (
+        (distance > 0) &
+        (distance < 100) &  # Reasonable max distance
+        (passengers > 0) &
+        (passengers <= 6) &
+        ~np.isnat(pickup) &
+        ~np.isnat(dropoff) &
+        (duration > 0) &
+        (duration <= 180) &
+        df['PULocationID'].between(LOCATION_IDS[0], LOCATION_IDS[-1]).to_numpy() &
+        df['DOLocationID'].between(LOCATION_IDS[0], LOCATION_IDS[-1]).to_numpy()
+    )
+    
+    # Extract temporal features directly from the datetime64 buffer
+    hour, day_of_week, month = temporal_features(pickup[mask].view('i8'))
+    
+    return pd.DataFrame({
+        'trip_distance': distance[mask],
+        'passenger_count': passengers[mask],
+        'hour': hour,
+        'day_of_week': day_of_week,
+        'month': month,
+        # Use location IDs as features (convert to numeric)
+        'pickup_location_id': df['PULocationID'].to_numpy()[mask].astype(int),
+        'dropoff_location_id': df['DOLocationID'].to_numpy()[mask].astype(int),
+        'trip_duration_minutes': duration[mask]
+    })
+
+
+def preprocess_data(filepath: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
     """
     Preprocess NYC taxi data for model training
     
+    The parquet file is streamed in record batches and only the columns
+    needed for feature engineering are decoded. Column-chunk reads are
+    pre-buffered so adjacent ranges are coalesced into fewer I/O calls.
+    
     Args:
         filepath: Path to the parquet file
+        columns: Output columns to keep (default: all features and the target)
         
     Returns:
         Preprocessed DataFrame
     """
     logger.info(f"Loading data from {filepath}")
-    df = pd.read_parquet(filepath)
-    
-    logger.info(f"Original data shape: {df.shape}")
+    pf = pq.ParquetFile(filepath, pre_buffer=True)
     
-    # Filter out invalid data
-    df = df[
-        (df['trip_distance'] > 0) &
-        (df['trip_distance'] < 100) &  # Reasonable max distance
-        (df['passenger_count'] > 0) &
-        (df['passenger_count'] <= 6) &
-        (df['PULocationID'].notna()) &
-        (df['DOLocationID'].notna())
-    ].copy()
-    
-    # Convert pickup/dropoff datetime
-    if 'lpep_pickup_datetime' in df.columns:
-        df['pickup_datetime'] = pd.to_datetime(df['lpep_pickup_datetime'])
-    elif 'pickup_datetime' in df.columns:
-        df['pickup_datetime'] = pd.to_datetime(df['pickup_datetime'])
-    
-    if 'lpep_dropoff_datetime' in df.columns:
-        df['dropoff_datetime'] = pd.to_datetime(df['lpep_dropoff_datetime'])
-    elif 'dropoff_datetime' in df.columns:
-        df['dropoff_datetime'] = pd.to_datetime(df['dropoff_datetime'])
-    
-    # Calculate trip duration in minutes
-    df['trip_duration_minutes'] = (
-        (df['dropoff_datetime'] - df['pickup_datetime']).dt.total_seconds() / 60
-    )
+    logger.info(f"Original data shape: ({pf.metadata.num_rows}, {pf.metadata.num_columns})")
     
-    # Filter out unrealistic trip durations (0-180 minutes)
-    df = df[(df['trip_duration_minutes'] > 0) & (df['trip_duration_minutes'] <= 180)].copy()
+    # Only decode the columns we actually use
+    available_columns = set(pf.schema_arrow.names)
+    needed = [col for col in RAW_COLUMNS if col in available_columns]
     
-    # Extract temporal features
-    df['hour'] = df['pickup_datetime'].dt.hour
-    df['day_of_week'] = df['pickup_datetime'].dt.dayofweek
-    df['month'] = df['pickup_datetime'].dt.month
+    parts = []
+    for batch in pf.iter_batches(batch_size=BATCH_SIZE, columns=needed, use_threads=True):
+        parts.append(_preprocess_batch(batch.to_pandas(self_destruct=True)))
     
-    # Use location IDs as features (convert to numeric)
-    df['pickup_location_id'] = df['PULocationID'].astype(int)
-    df['dropoff_location_id'] = df['DOLocationID'].astype(int)
+    if parts:
+        df = pd.concat(parts, ignore_index=True, copy=False)
+    else:
+        # File has no row groups
+        df = pd.DataFrame(columns=list(PROCESSED_DTYPES))
     
     # Select features - use available columns
-    config = load_config()
-    # Update feature list to match available data
-    available_features = [
-        'trip_distance',
-        'passenger_count',
-        'hour',
-        'day_of_week',
-        'month',
-        'pickup_location_id',
-        'dropoff_location_id'
-    ]
-    
-    # Add target
-    available_features.append(config['model']['target'])
+    if columns is not None:
+        available_features = list(columns)
+    else:
+        config = load_config()
+        # Update feature list to match available data
+        available_features = [
+            'trip_distance',
+            'passenger_count',
+            'hour',
+            'day_of_week',
+            'month',
+            'pickup_location_id',
+            'dropoff_location_id'
+        ]
+        
+        # Add target
+        available_features.append(config['model']['target'])
     
     # Select only available columns
-    df = df[[col for col in available_features if col in df.columns]].copy()
+    df = df[[col for col in available_features if col in df.columns]]
     
-    # Remove rows with missing values
-    df = df.dropna()
+    # No dropna() needed: the batch mask already rejects rows with missing
+    # distance, passenger count, timestamps or location IDs
+    
+    # Downcast to compact dtypes
+    df = df.astype(
+        {col: dtype for col, dtype in PROCESSED_DTYPES.items() if col in df.columns},
+        copy=False
+    )
     
     logger.info(f"Preprocessed data shape: {df.shape}")
     logger.info(f"Features: {list(df.columns)}")
@@ -146,13 +315,19 @@ def preprocess_data(filepath: str) -> pd.DataFrame:
     return df
 
 
-def ingest_data(month: str, save_processed: bool = True) -> pd.DataFrame:
+def ingest_data(
+    month: str,
+    save_processed: Union[bool, str] = True,
+    columns: Optional[List[str]] = None
+) -> pd.DataFrame:
     """
     Main function to ingest and preprocess data
     
     Args:
         month: Month in format 'YYYY-MM'
-        save_processed: Whether to save processed data to CSV
+        save_processed: Whether to save processed data (snappy Parquet),
+            or 'csv' to save it in the legacy CSV format
+        columns: Output columns to keep (default: all features and the target)
         
     Returns:
         Preprocessed DataFrame
@@ -164,13 +339,23 @@ def ingest_data(month: str, save_processed: bool = True) -> pd.DataFrame:
     filepath = download_nyc_taxi_data(month, data_dir)
     
     # Preprocess data
-    df = preprocess_data(filepath)
+    df = preprocess_data(filepath, columns)
     
     # Save processed data
-    if save_processed:
+    if save_processed == 'csv':
         processed_path = os.path.join(data_dir, f"processed_{month}.csv")
         df.to_csv(processed_path, index=False)
         logger.info(f"Saved processed data to {processed_path}")
+    elif save_processed:
+        processed_path = os.path.join(data_dir, f"processed_{month}.parquet")
+        df.to_parquet(
+            processed_path,
+            engine='pyarrow',
+            compression='snappy',
+            use_dictionary=True,
+            index=False
+        )
+        logger.info(f"Saved processed data to {processed_path}")
     
     return df
 
@@ -181,10 +366,12 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ingest NYC Taxi Trip Data")
     parser.add_argument("--month", type=str, default="2023-01", help="Month in YYYY-MM format")
     parser.add_argument("--save", action="store_true", help="Save processed data")
+    parser.add_argument("--csv", action="store_true", help="Save processed data as CSV instead of Parquet")
     
     args = parser.parse_args()
     
-    df = ingest_data(args.month, save_processed=args.save)
+    save_processed = 'csv' if args.save and args.csv else args.save
+    df = ingest_data(args.month, save_processed=save_processed)
     print(f"\nData ingestion complete!")
     print(f"Shape: {df.shape}")
     print(f"Columns: {list(df.columns)}")
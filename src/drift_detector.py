@@ -1,5 +1,5 @@
 """
-Drift Detection Module using EvidentlyAI
+Drift Detection Module using per-feature Kolmogorov-Smirnov tests
 Monitors incoming predictions and detects concept drift
 """
 
@@ -8,40 +8,131 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 import yaml
+from functools import lru_cache
+from types import MappingProxyType
 import requests
+from requests.adapters import HTTPAdapter
 import json
-from typing import Optional, Tuple
-from evidently import ColumnMapping
-from evidently.report import Report
-from evidently.metric_preset import DataDriftPreset
+import hashlib
+from typing import Optional, Tuple, TYPE_CHECKING
+from scipy.stats import kstwobign
+from numba import njit, prange
 import logging
 import joblib
 
+if TYPE_CHECKING:
+    from evidently.report import Report
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Significance level for the per-feature Kolmogorov-Smirnov test
+KS_P_VALUE = 0.05
+
 
+@njit(parallel=True, cache=True)
+def ks_statistics(ref: np.ndarray, cur: np.ndarray, out: np.ndarray, n_ref: np.ndarray, n_cur: np.ndarray):
+    """
+    Two-sample KS statistic for every column of ref vs cur, written to out
+    
+    Non-finite values are dropped per column; the remaining sample sizes are
+    written to n_ref and n_cur.
+    """
+    for k in prange(ref.shape[1]):
+        r = ref[:, k].copy()
+        c = cur[:, k].copy()
+        r = np.sort(r[np.isfinite(r)])
+        c = np.sort(c[np.isfinite(c)])
+        n = r.shape[0]
+        m = c.shape[0]
+        n_ref[k] = n
+        n_cur[k] = m
+        i = 0
+        j = 0
+        max_dist = 0.0
+        while i < n and j < m:
+            v = min(r[i], c[j])
+            # Step past ties on both sides before comparing the CDFs
+            while i < n and r[i] == v:
+                i += 1
+            while j < m and c[j] == v:
+                j += 1
+            dist = abs(i / n - j / m)
+            if dist > max_dist:
+                max_dist = dist
+        out[k] = max_dist
+
+
+@lru_cache(maxsize=1)
 def load_config():
-    """Load configuration from config.yaml"""
+    """Load configuration from config.yaml (parsed once per process, read-only)"""
     config_path = Path(__file__).parent.parent / "config.yaml"
     with open(config_path, 'r') as f:
-        return yaml.safe_load(f)
+        return MappingProxyType(yaml.safe_load(f))
+
+
+# Modules whose code determines the processed reference data
+PREPROCESSING_SOURCES = ("data_ingestion.py", "features.py")
 
 
-def load_reference_data(month: str = "2023-01") -> pd.DataFrame:
+def reference_fingerprint(columns: list) -> str:
+    """
+    Fingerprint of the preprocessing code and reference columns
+    
+    Cached reference data built with a different fingerprint is stale.
+    """
+    digest = hashlib.sha256(json.dumps(columns).encode())
+    for name in PREPROCESSING_SOURCES:
+        digest.update((Path(__file__).parent / name).read_bytes())
+    return digest.hexdigest()
+
+
+def load_reference_data(month: str = "2023-01", refresh: bool = False) -> pd.DataFrame:
     """
     Load reference data (baseline month)
     
+    The processed reference features are cached as a float32 .npy file in the
+    data directory and memory-mapped on later calls, so the download and
+    preprocessing pipeline only runs once per month. The cache is rebuilt when
+    the preprocessing code or the configured features change.
+    
     Args:
         month: Reference month in format 'YYYY-MM'
+        refresh: Rebuild the cached reference data
         
     Returns:
         Reference DataFrame
     """
+    config = load_config()
+    data_dir = config['data']['data_dir']
+    array_path = os.path.join(data_dir, f"reference_{month}.npy")
+    columns_path = os.path.join(data_dir, f"reference_{month}.json")
+    expected_columns = config['model']['features'] + [config['model']['target']]
+    fingerprint = reference_fingerprint(expected_columns)
+    
+    if not refresh and os.path.exists(array_path) and os.path.exists(columns_path):
+        with open(columns_path, 'r') as f:
+            metadata = json.load(f)
+        if isinstance(metadata, dict) and metadata.get('fingerprint') == fingerprint:
+            X = np.load(array_path, mmap_mode='r')
+            logger.info(f"Loaded cached reference data from {array_path}")
+            return pd.DataFrame(X, columns=metadata['columns'], copy=False)
+        logger.info("Preprocessing or features changed. Rebuilding cached reference data")
+    
     from data_ingestion import ingest_data
     
     df = ingest_data(month, save_processed=False)
-    return df
+    
+    columns = [c for c in expected_columns if c in df.columns]
+    X = df[columns].to_numpy(np.float32)
+    
+    Path(data_dir).mkdir(parents=True, exist_ok=True)
+    np.save(array_path, X)
+    with open(columns_path, 'w') as f:
+        json.dump({'columns': columns, 'fingerprint': fingerprint}, f)
+    logger.info(f"Cached reference data to {array_path}")
+    
+    return pd.DataFrame(X, columns=columns, copy=False)
 
 
 def get_predictions_from_api(api_url: str = "http://localhost:8000", n_samples: int = 100) -> pd.DataFrame:
@@ -56,57 +147,147 @@ def get_predictions_from_api(api_url: str = "http://localhost:8000", n_samples:
         DataFrame with features and predictions
     """
     # Generate random but realistic NYC taxi trip data
-    np.random.seed(42)
+    rng = np.random.default_rng(42)
     
     # NYC coordinates bounds
     nyc_lon_min, nyc_lon_max = -74.3, -73.7
     nyc_lat_min, nyc_lat_max = 40.5, 40.9
     
-    data = []
-    for _ in range(n_samples):
-        trip = {
-            "pickup_longitude": np.random.uniform(nyc_lon_min, nyc_lon_max),
-            "pickup_latitude": np.random.uniform(nyc_lat_min, nyc_lat_max),
-            "dropoff_longitude": np.random.uniform(nyc_lon_min, nyc_lon_max),
-            "dropoff_latitude": np.random.uniform(nyc_lat_min, nyc_lat_max),
-            "passenger_count": np.random.randint(1, 7),
-            "trip_distance": np.random.uniform(0.5, 20.0),
-            "hour": np.random.randint(0, 24),
-            "day_of_week": np.random.randint(0, 7),
-            "month": np.random.randint(1, 13)
-        }
+    data = {
+        "pickup_longitude": rng.uniform(nyc_lon_min, nyc_lon_max, n_samples),
+        "pickup_latitude": rng.uniform(nyc_lat_min, nyc_lat_max, n_samples),
+        "dropoff_longitude": rng.uniform(nyc_lon_min, nyc_lon_max, n_samples),
+        "dropoff_latitude": rng.uniform(nyc_lat_min, nyc_lat_max, n_samples),
+        "passenger_count": rng.integers(1, 7, n_samples),
+        "trip_distance": rng.uniform(0.5, 20.0, n_samples),
+        "hour": rng.integers(0, 24, n_samples),
+        "day_of_week": rng.integers(0, 7, n_samples),
+        "month": rng.integers(1, 13, n_samples),
+        "pickup_location_id": rng.integers(1, 266, n_samples),
+        "dropoff_location_id": rng.integers(1, 266, n_samples)
+    }
+    df = pd.DataFrame(data)
+    trips = df.to_dict('records')
+    
+    try:
+        # Single batch request over a pooled connection
+        with requests.Session() as session:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            response = session.post(f"{api_url}/predict_batch", json=trips, timeout=30)
+            response.raise_for_status()
+        df['predicted_duration'] = [
+            result['predicted_duration_minutes'] for result in response.json()
+        ]
+    except Exception as e:
+        logger.warning(f"Error getting predictions: {e}")
+        # Use mock predictions if API is unavailable
+        df['predicted_duration'] = rng.uniform(5, 60, n_samples)
+    
+    return df
+
+
+def ks_p_values(ref: np.ndarray, cur: np.ndarray) -> np.ndarray:
+    """
+    Per-column two-sample Kolmogorov-Smirnov p-values
+    
+    Uses the parallel numba kernel with asymptotic p-values. Features with
+    no finite samples on either side get a p-value of 1 (no evidence of drift).
+    
+    Args:
+        ref: Reference samples, shape (n, n_features)
+        cur: Current samples, shape (m, n_features)
         
-        try:
-            response = requests.post(f"{api_url}/predict", json=trip, timeout=5)
-            if response.status_code == 200:
-                result = response.json()
-                trip['predicted_duration'] = result['predicted_duration_minutes']
-                data.append(trip)
-        except Exception as e:
-            logger.warning(f"Error getting prediction: {e}")
-            # Use a mock prediction if API is unavailable
-            trip['predicted_duration'] = np.random.uniform(5, 60)
-            data.append(trip)
-    
-    return pd.DataFrame(data)
+    Returns:
+        Array of p-values, one per feature
+    """
+    n_features = ref.shape[1]
+    statistics = np.zeros(n_features)
+    n = np.empty(n_features, dtype=np.int64)
+    m = np.empty(n_features, dtype=np.int64)
+    ks_statistics(np.ascontiguousarray(ref), np.ascontiguousarray(cur), statistics, n, m)
+    
+    p_values = np.ones(n_features)
+    valid = (n > 0) & (m > 0)
+    effective_n = n[valid] * m[valid] / (n[valid] + m[valid])
+    p_values[valid] = kstwobign.sf(statistics[valid] * np.sqrt(effective_n))
+    return p_values
 
 
 def check_drift(
     reference_data: pd.DataFrame,
     current_data: pd.DataFrame,
-    threshold: float = 0.5
+    threshold: float = 0.5,
+    full_report: bool = False
+) -> Tuple[bool, dict]:
+    """
+    Check for data drift with a two-sample KS test per feature
+    
+    A feature is drifted when its KS p-value is below KS_P_VALUE, and drift is
+    detected when the share of drifted features exceeds the threshold.
+    
+    Args:
+        reference_data: Reference (baseline) data
+        current_data: Current production data
+        threshold: Drift threshold (0-1)
+        full_report: Run the full EvidentlyAI report instead (offline use)
+        
+    Returns:
+        Tuple of (drift_detected, drift_report)
+    """
+    if full_report:
+        return check_drift_evidently(reference_data, current_data, threshold)
+    
+    config = load_config()
+    features = [
+        f for f in config['model']['features']
+        if f in reference_data.columns and f in current_data.columns
+    ]
+    
+    p_values = ks_p_values(
+        reference_data[features].to_numpy(np.float32),
+        current_data[features].to_numpy(np.float32)
+    )
+    drifted_features = [f for f, p in zip(features, p_values) if p < KS_P_VALUE]
+    
+    drift_score = len(drifted_features) / len(features) if features else 0.0
+    drift_detected = drift_score > threshold
+    
+    drift_info = {
+        "drift_detected": drift_detected,
+        "drift_score": drift_score,
+        "threshold": threshold,
+        "drifted_features": drifted_features,
+        "reference_samples": len(reference_data),
+        "current_samples": len(current_data)
+    }
+    
+    return drift_detected, drift_info
+
+
+def check_drift_evidently(
+    reference_data: pd.DataFrame,
+    current_data: pd.DataFrame,
+    threshold: float = 0.5,
+    output_path: str = "drift_report.html"
 ) -> Tuple[bool, dict]:
     """
-    Check for data drift using EvidentlyAI
+    Check for data drift using a full EvidentlyAI report and save it as HTML
     
     Args:
         reference_data: Reference (baseline) data
         current_data: Current production data
         threshold: Drift threshold (0-1)
+        output_path: Path to save the HTML report
         
     Returns:
         Tuple of (drift_detected, drift_report)
     """
+    from evidently import ColumnMapping
+    from evidently.report import Report
+    from evidently.metric_preset import DataDriftPreset
+    
     config = load_config()
     features = config['model']['features']
     target = config['model']['target']
@@ -127,6 +308,7 @@ def check_drift(
         current_data=current_data,
         column_mapping=column_mapping
     )
+    save_drift_report(drift_report, output_path)
     
     # Get drift metrics
     report_dict = drift_report.as_dict()
@@ -163,7 +345,7 @@ def check_drift(
     return drift_detected, drift_info
 
 
-def save_drift_report(report: Report, output_path: str = "drift_report.html"):
+def save_drift_report(report: "Report", output_path: str = "drift_report.html"):
     """
     Save drift report to HTML file
     
@@ -227,7 +409,9 @@ def monitor_drift(
     current_month: Optional[str] = None,
     api_url: str = "http://localhost:8000",
     threshold: float = 0.5,
-    n_samples: int = 1000
+    n_samples: int = 1000,
+    full_report: bool = False,
+    refresh_reference: bool = False
 ) -> bool:
     """
     Main function to monitor drift and trigger retraining if needed
@@ -238,6 +422,8 @@ def monitor_drift(
         api_url: URL of the serving API
         threshold: Drift threshold
         n_samples: Number of samples to analyze
+        full_report: Generate the full EvidentlyAI HTML report
+        refresh_reference: Rebuild the cached reference data
         
     Returns:
         True if drift detected and retraining triggered
@@ -246,7 +432,7 @@ def monitor_drift(
     
     # Load reference data
     logger.info(f"Loading reference data for month: {reference_month}")
-    reference_data = load_reference_data(reference_month)
+    reference_data = load_reference_data(reference_month, refresh=refresh_reference)
     
     # Get current data
     if current_month:
@@ -259,7 +445,7 @@ def monitor_drift(
     
     # Check for drift
     logger.info("Checking for data drift...")
-    drift_detected, drift_info = check_drift(reference_data, current_data, threshold)
+    drift_detected, drift_info = check_drift(reference_data, current_data, threshold, full_report)
     
     logger.info(f"Drift check results: {drift_info}")
     
@@ -281,6 +467,8 @@ if __name__ == "__main__":
     parser.add_argument("--api-url", type=str, default="http://localhost:8000", help="Serving API URL")
     parser.add_argument("--threshold", type=float, default=0.5, help="Drift threshold")
     parser.add_argument("--samples", type=int, default=1000, help="Number of samples to analyze")
+    parser.add_argument("--full-report", action="store_true", help="Generate full EvidentlyAI HTML report")
+    parser.add_argument("--refresh-reference", action="store_true", help="Rebuild cached reference data")
     
     args = parser.parse_args()
     
@@ -289,6 +477,8 @@ if __name__ == "__main__":
         current_month=args.current_month,
         api_url=args.api_url,
         threshold=args.threshold,
-        n_samples=args.samples
+        n_samples=args.samples,
+        full_report=args.full_report,
+        refresh_reference=args.refresh_reference
     )
 
@@ -0,0 +1,71 @@
+"""
+Feature Engineering Kernels
+Numeric per-row transforms used when preprocessing NYC taxi trips
+"""
+
+import numpy as np
+from numba import njit, prange
+
+# Nanoseconds per minute / hour / day
+NS_PER_MINUTE = 60 * 10**9
+NS_PER_HOUR = 60 * NS_PER_MINUTE
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+# 1970-01-01 was a Thursday (Monday=0)
+EPOCH_DAY_OF_WEEK = 3
+
+
+@njit(parallel=True, cache=True, fastmath=True)
+def _duration_minutes_kernel(pickup_ns, dropoff_ns, out):
+    for i in prange(pickup_ns.shape[0]):
+        out[i] = (dropoff_ns[i] - pickup_ns[i]) / NS_PER_MINUTE
+
+
+@njit(parallel=True, cache=True)
+def _temporal_kernel(pickup_ns, hour, day_of_week, month):
+    for i in prange(pickup_ns.shape[0]):
+        ns = pickup_ns[i]
+        days = ns // NS_PER_DAY
+        hour[i] = ns // NS_PER_HOUR % 24
+        day_of_week[i] = (days + EPOCH_DAY_OF_WEEK) % 7
+        # Civil month from days since epoch (proleptic Gregorian calendar)
+        z = days + 719468
+        doe = z - (z // 146097) * 146097
+        yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+        doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+        mp = (5 * doy + 2) // 153
+        month[i] = mp + 3 if mp < 10 else mp - 9
+
+
+def trip_duration_minutes(pickup_ns: np.ndarray, dropoff_ns: np.ndarray) -> np.ndarray:
+    """
+    Trip durations in minutes
+    
+    Args:
+        pickup_ns: Pickup timestamps as int64 nanoseconds since epoch
+        dropoff_ns: Dropoff timestamps as int64 nanoseconds since epoch
+    
+    Returns:
+        float32 array of durations
+    """
+    out = np.empty(pickup_ns.shape[0], dtype=np.float32)
+    _duration_minutes_kernel(pickup_ns, dropoff_ns, out)
+    return out
+
+
+def temporal_features(pickup_ns: np.ndarray) -> tuple:
+    """
+    Hour of day, day of week (Monday=0) and month of pickup timestamps
+    
+    Args:
+        pickup_ns: Pickup timestamps as int64 nanoseconds since epoch
+    
+    Returns:
+        Tuple of uint8 arrays (hour, day_of_week, month)
+    """
+    n = pickup_ns.shape[0]
+    hour = np.empty(n, dtype=np.uint8)
+    day_of_week = np.empty(n, dtype=np.uint8)
+    month = np.empty(n, dtype=np.uint8)
+    _temporal_kernel(pickup_ns, hour, day_of_week, month)
+    return hour, day_of_week, month
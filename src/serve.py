@@ -6,15 +6,19 @@ Serves the trained model for predictions
 import os
 import joblib
 import numpy as np
-import pandas as pd
 from pathlib import Path
 import yaml
 import mlflow
 import mlflow.sklearn
+from anyio import to_thread
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel, Field
 from typing import List
 import logging
+import threading
+import warnings
+from collections import OrderedDict
+import sklearn
 import uvicorn
 
 logging.basicConfig(level=logging.INFO)
@@ -22,6 +26,11 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="NYC Taxi Trip Duration Prediction API", version="1.0.0")
 
+# Reusable batch feature buffers keyed by batch size (most recently used last)
+MAX_BUFFER_SIZES = 8
+_buf_pool: "OrderedDict[int, List[np.ndarray]]" = OrderedDict()
+_buf_pool_lock = threading.Lock()
+
 
 def load_config():
     """Load configuration from config.yaml"""
@@ -78,10 +87,89 @@ def load_model(model_version: str = "latest"):
     return model, features
 
 
+def build_onnx_session(model, n_features: int):
+    """
+    Convert a sklearn model to an ONNX Runtime inference session
+    
+    Args:
+        model: Trained sklearn model
+        n_features: Number of input features
+        
+    Returns:
+        InferenceSession, or None if ONNX Runtime is unavailable or conversion fails
+    """
+    try:
+        import onnxruntime
+        from skl2onnx import convert_sklearn
+        from skl2onnx.common.data_types import FloatTensorType
+    except ImportError:
+        logger.info("onnxruntime/skl2onnx not installed. Serving with sklearn.")
+        return None
+    
+    try:
+        onx = convert_sklearn(model, initial_types=[('X', FloatTensorType([None, n_features]))])
+        session = onnxruntime.InferenceSession(
+            onx.SerializeToString(),
+            providers=['CPUExecutionProvider']
+        )
+        logger.info("Serving with ONNX Runtime")
+        return session
+    except Exception as e:
+        logger.warning(f"Could not convert model to ONNX: {e}. Serving with sklearn.")
+        return None
+
+
+def predict_array(X: np.ndarray) -> np.ndarray:
+    """
+    Predict trip durations for a float32 feature array
+    
+    Args:
+        X: Array of shape (n_trips, n_features) in training feature order
+        
+    Returns:
+        1-D array of predicted durations
+    """
+    if onnx_session is not None:
+        return onnx_session.run(None, {'X': X})[0].ravel()
+    # Requests are validated by pydantic, so skip sklearn's finiteness checks.
+    # sklearn config is thread-local, so it must be set on the worker thread.
+    with sklearn.config_context(assume_finite=True):
+        return model.predict(X)
+
+
+def acquire_buffer(n_rows: int) -> np.ndarray:
+    """
+    Take a float32 feature buffer with n_rows rows from the pool
+    
+    The buffer is owned by the caller until it is handed back with
+    release_buffer, so concurrent requests never share one.
+    """
+    with _buf_pool_lock:
+        buffers = _buf_pool.get(n_rows)
+        if buffers:
+            _buf_pool.move_to_end(n_rows)
+            return buffers.pop()
+    return np.empty((n_rows, len(features)), dtype=np.float32)
+
+
+def release_buffer(buf: np.ndarray):
+    """Return a feature buffer to the pool, evicting the least recently used size"""
+    n_rows = buf.shape[0]
+    with _buf_pool_lock:
+        _buf_pool.setdefault(n_rows, []).append(buf)
+        _buf_pool.move_to_end(n_rows)
+        while len(_buf_pool) > MAX_BUFFER_SIZES:
+            _buf_pool.popitem(last=False)
+
+
 # Load model at startup
 config = load_config()
 serving_config = config['serving']
 model, features = load_model(serving_config['model_version'])
+onnx_session = build_onnx_session(model, len(features))
+
+# Silence the feature-name warning when predicting on plain NumPy arrays
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
 
 
 class TripRequest(BaseModel):
@@ -91,8 +179,8 @@ class TripRequest(BaseModel):
     hour: int = Field(..., ge=0, le=23, description="Hour of day (0-23)")
     day_of_week: int = Field(..., ge=0, le=6, description="Day of week (0=Monday, 6=Sunday)")
     month: int = Field(..., ge=1, le=12, description="Month (1-12)")
-    pickup_location_id: int = Field(..., ge=1, description="Pickup location ID")
-    dropoff_location_id: int = Field(..., ge=1, description="Dropoff location ID")
+    pickup_location_id: int = Field(..., ge=1, le=265, description="Pickup location ID (TLC taxi zone)")
+    dropoff_location_id: int = Field(..., ge=1, le=265, description="Dropoff location ID (TLC taxi zone)")
 
 
 class TripResponse(BaseModel):
@@ -101,6 +189,12 @@ class TripResponse(BaseModel):
     model_version: str = Field(..., description="Model version used")
 
 
+@app.on_event("startup")
+async def configure_threadpool():
+    """Size the threadpool that runs the sync (CPU-bound) prediction endpoints"""
+    to_thread.current_default_thread_limiter().total_tokens = max(8, (os.cpu_count() or 1) * 2)
+
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -118,7 +212,7 @@ async def health():
 
 
 @app.post("/predict", response_model=TripResponse)
-async def predict(trip: TripRequest):
+def predict(trip: TripRequest):
     """
     Predict trip duration for a given trip
     
@@ -129,22 +223,12 @@ async def predict(trip: TripRequest):
         TripResponse with predicted duration
     """
     try:
-        # Prepare features in correct order
-        feature_values = [
-            trip.trip_distance,
-            trip.passenger_count,
-            trip.hour,
-            trip.day_of_week,
-            trip.month,
-            trip.pickup_location_id,
-            trip.dropoff_location_id
-        ]
-        
-        # Create DataFrame
-        X = pd.DataFrame([feature_values], columns=features)
+        # Prepare features in training order
+        X = np.empty((1, len(features)), dtype=np.float32)
+        X[0, :] = [getattr(trip, f) for f in features]
         
         # Make prediction
-        prediction = model.predict(X)[0]
+        prediction = predict_array(X)[0]
         
         return TripResponse(
             predicted_duration_minutes=float(prediction),
@@ -157,7 +241,7 @@ async def predict(trip: TripRequest):
 
 
 @app.post("/predict_batch")
-async def predict_batch(trips: List[TripRequest]):
+def predict_batch(trips: List[TripRequest]):
     """
     Predict trip duration for multiple trips
     
@@ -168,31 +252,24 @@ async def predict_batch(trips: List[TripRequest]):
         List of predictions
     """
     try:
-        # Prepare features
-        feature_values = []
-        for trip in trips:
-            feature_values.append([
-                trip.trip_distance,
-                trip.passenger_count,
-                trip.hour,
-                trip.day_of_week,
-                trip.month,
-                trip.pickup_location_id,
-                trip.dropoff_location_id
-            ])
-        
-        # Create DataFrame
-        X = pd.DataFrame(feature_values, columns=features)
-        
-        # Make predictions
-        predictions = model.predict(X)
+        # Prepare features in training order
+        X = acquire_buffer(len(trips))
+        try:
+            for i, trip in enumerate(trips):
+                X[i] = [getattr(trip, f) for f in features]
+            
+            # Make predictions
+            predictions = predict_array(X)
+        finally:
+            release_buffer(X)
         
+        model_version = serving_config['model_version']
         return [
             {
-                "predicted_duration_minutes": float(pred),
-                "model_version": serving_config['model_version']
+                "predicted_duration_minutes": pred,
+                "model_version": model_version
             }
-            for pred in predictions
+            for pred in predictions.tolist()
         ]
     
     except Exception as e:
@@ -206,6 +283,7 @@ async def model_info():
     return {
         "features": features,
         "model_type": type(model).__name__,
+        "inference_backend": "onnxruntime" if onnx_session is not None else "sklearn",
         "model_version": serving_config['model_version']
     }
 
@@ -12,7 +12,7 @@ import joblib
 import mlflow
 import mlflow.sklearn
 from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.ensemble import HistGradientBoostingRegressor
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import logging
 from datetime import datetime
@@ -22,10 +22,37 @@ from data_ingestion import ingest_data, load_config
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# sklearn >= 1.4 provides RMSE directly; older versions use squared=False
+try:
+    from sklearn.metrics import root_mean_squared_error
+except ImportError:
+    def root_mean_squared_error(y_true, y_pred):
+        return mean_squared_error(y_true, y_pred, squared=False)
+
+# lz4 decompresses at close to memory speed; fall back to zlib if it is not installed
+try:
+    import lz4  # noqa: F401
+    MODEL_COMPRESSION = ('lz4', 3)
+except ImportError:
+    MODEL_COMPRESSION = ('zlib', 3)
+
+
+# Gradient boosting hyperparameters (also logged to MLflow)
+MODEL_PARAMS = {
+    'max_iter': 200,
+    'max_depth': 8,
+    'learning_rate': 0.05,
+    'early_stopping': True,
+    'random_state': 42
+}
+
+# Training rows beyond this are subsampled; boosting accuracy plateaus well below a full month
+MAX_TRAIN_SAMPLES = 1_000_000
+
 
 def train_model(df: pd.DataFrame, model_dir: str = "models") -> tuple:
     """
-    Train a Random Forest model to predict trip duration
+    Train a histogram gradient boosting model to predict trip duration
     
     Args:
         df: Preprocessed DataFrame
@@ -38,9 +65,10 @@ def train_model(df: pd.DataFrame, model_dir: str = "models") -> tuple:
     target = config['model']['target']
     features = config['model']['features']
     
-    # Prepare features and target
-    X = df[features].copy()
-    y = df[target].copy()
+    # Prepare features and target as the float32 arrays the model consumes
+    X = df[features].to_numpy(dtype=np.float32)
+    y = df[target].to_numpy(dtype=np.float32, copy=False)
+    del df
     
     logger.info(f"Training on {len(X)} samples with {len(features)} features")
     
@@ -48,31 +76,31 @@ def train_model(df: pd.DataFrame, model_dir: str = "models") -> tuple:
     X_train, X_test, y_train, y_test = train_test_split(
         X, y, test_size=0.2, random_state=42
     )
+    del X, y
     
-    # Train model (smaller for GitHub compatibility)
-    model = RandomForestRegressor(
-        n_estimators=50,  # Reduced from 100 for smaller file size
-        max_depth=15,     # Reduced from 20
-        min_samples_split=5,
-        min_samples_leaf=2,
-        random_state=42,
-        n_jobs=-1
-    )
+    # Subsample very large training sets to bound fit time
+    if len(X_train) > MAX_TRAIN_SAMPLES:
+        logger.info(f"Subsampling {MAX_TRAIN_SAMPLES} of {len(X_train)} training rows")
+        idx = np.random.default_rng(42).choice(len(X_train), MAX_TRAIN_SAMPLES, replace=False)
+        X_train = X_train[idx]
+        y_train = y_train[idx]
     
-    logger.info("Training Random Forest model...")
+    # Column-major layout used by tree split scans
+    X_train = np.asfortranarray(X_train)
+    
+    # Train model (histogram-binned trees; small on disk for GitHub compatibility)
+    model = HistGradientBoostingRegressor(**MODEL_PARAMS)
+    
+    logger.info("Training HistGradientBoosting model...")
     model.fit(X_train, y_train)
     
-    # Make predictions
-    y_pred_train = model.predict(X_train)
+    # Make predictions (held-out set only; early stopping already tracks in-fit scores)
     y_pred_test = model.predict(X_test)
     
     # Calculate metrics
     metrics = {
-        'train_mae': mean_absolute_error(y_train, y_pred_train),
         'test_mae': mean_absolute_error(y_test, y_pred_test),
-        'train_rmse': np.sqrt(mean_squared_error(y_train, y_pred_train)),
-        'test_rmse': np.sqrt(mean_squared_error(y_test, y_pred_test)),
-        'train_r2': r2_score(y_train, y_pred_train),
+        'test_rmse': root_mean_squared_error(y_test, y_pred_test),
         'test_r2': r2_score(y_test, y_pred_test),
     }
     
@@ -84,7 +112,7 @@ def train_model(df: pd.DataFrame, model_dir: str = "models") -> tuple:
     # Save model locally
     Path(model_dir).mkdir(parents=True, exist_ok=True)
     model_path = os.path.join(model_dir, "model.joblib")
-    joblib.dump(model, model_path)
+    joblib.dump(model, model_path, compress=MODEL_COMPRESSION)
     logger.info(f"Model saved to {model_path}")
     
     # Save feature names for serving
@@ -113,15 +141,20 @@ def log_to_mlflow(model, metrics: dict, features: list, month: str):
     
     with mlflow.start_run(run_name=f"model_v1_{month}"):
         # Log parameters
-        mlflow.log_param("month", month)
-        mlflow.log_param("n_features", len(features))
-        mlflow.log_param("model_type", "RandomForestRegressor")
-        mlflow.log_param("n_estimators", 100)
-        mlflow.log_param("max_depth", 20)
+        mlflow.log_params({
+            "month": month,
+            "n_features": len(features),
+            "model_type": type(model).__name__,
+            "max_iter": MODEL_PARAMS['max_iter'],
+            "max_depth": MODEL_PARAMS['max_depth'],
+            "learning_rate": MODEL_PARAMS['learning_rate'],
+            "n_iter": model.n_iter_,
+            "max_train_samples": MAX_TRAIN_SAMPLES,
+            "features": ",".join(features)
+        })
         
         # Log metrics
-        for key, value in metrics.items():
-            mlflow.log_metric(key, value)
+        mlflow.log_metrics(metrics)
         
         # Log model
         mlflow.sklearn.log_model(
@@ -130,9 +163,6 @@ def log_to_mlflow(model, metrics: dict, features: list, month: str):
             registered_model_name="nyc_taxi_trip_duration"
         )
         
-        # Log features
-        mlflow.log_param("features", ",".join(features))
-        
         run_id = mlflow.active_run().info.run_id
         logger.info(f"Logged to MLflow with run_id: {run_id}")
 
@@ -146,11 +176,14 @@ def main(month: str = "2023-01"):
     """
     logger.info(f"Starting model training for month: {month}")
     
-    # Ingest data
-    df = ingest_data(month, save_processed=False)
+    config = load_config()
+    columns = config['model']['features'] + [config['model']['target']]
     
-    # Train model
-    model, metrics, features = train_model(df)
+    # Ingest only the model columns and hand the frame straight to training,
+    # so it is released once converted to arrays
+    model, metrics, features = train_model(
+        ingest_data(month, save_processed=False, columns=columns)
+    )
     
     # Log to MLflow
     log_to_mlflow(model, metrics, features, month)
@@ -12,8 +12,17 @@ from pathlib import Path
 import yaml
 import mlflow
 import mlflow.sklearn
+from mlflow.tracking import MlflowClient
 from datetime import datetime
 import requests
+import warnings
+import sklearn
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Predictions use plain NumPy arrays laid out in training feature order
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
 
 # Page config
 st.set_page_config(
@@ -46,28 +55,75 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-@st.cache_data
+@st.cache_resource
 def load_config():
-    """Load configuration"""
+    """Load configuration (parsed once per process and shared, not copied, per call)"""
     config_path = Path(__file__).parent / "config.yaml"
     with open(config_path, 'r') as f:
         return yaml.safe_load(f)
 
 
-@st.cache_resource
-def load_model():
-    """Load the trained model"""
+def load_mlflow_model(model_dir, default_features, name="nyc_taxi_trip_duration"):
+    """
+    Load the latest registered MLflow model and its training feature order
+    
+    The model is cached in a local snapshot that survives process restarts and
+    is only refreshed when the registered version changes, so the registry
+    download is skipped otherwise. The feature order is taken from the
+    training run's logged "features" param. The snapshot also holds the
+    model's ONNX conversion, so it is only converted once per version.
+    
+    Returns:
+        Tuple of (model, features, serialized ONNX model or None)
+    """
+    client = MlflowClient()
+    versions = client.get_latest_versions(name)
+    if not versions:
+        raise LookupError(f"No registered versions of model {name}")
+    latest = max(versions, key=lambda v: int(v.version))
+    version_tag = f"{latest.version}:{latest.run_id}"
+    
+    snapshot_path = os.path.join(model_dir, "mlflow_snapshot.joblib")
+    version_path = os.path.join(model_dir, ".mlflow_version")
+    
+    if os.path.exists(snapshot_path) and os.path.exists(version_path):
+        with open(version_path, 'r') as f:
+            if f.read().strip() == version_tag:
+                snapshot = joblib.load(snapshot_path, mmap_mode='r')
+                return snapshot['model'], snapshot['features'], snapshot.get('onnx')
+    
+    model = mlflow.sklearn.load_model(model_uri=f"models:/{name}/{latest.version}")
+    logged_features = client.get_run(latest.run_id).data.params.get('features')
+    features = logged_features.split(',') if logged_features else list(default_features)
+    onnx_model = convert_to_onnx(model, len(features))
+    
+    # Write to temp files and swap them in, snapshot first: other processes may
+    # still have the old snapshot memory-mapped, so it must never be truncated
+    Path(model_dir).mkdir(parents=True, exist_ok=True)
+    tmp_snapshot_path = f"{snapshot_path}.{os.getpid()}.part"
+    tmp_version_path = f"{version_path}.{os.getpid()}.part"
+    joblib.dump({'model': model, 'features': features, 'onnx': onnx_model}, tmp_snapshot_path)
+    os.replace(tmp_snapshot_path, snapshot_path)
+    with open(tmp_version_path, 'w') as f:
+        f.write(version_tag)
+    os.replace(tmp_version_path, version_path)
+    return model, features, onnx_model
+
+
+def load_sklearn_model():
+    """
+    Load the trained sklearn model
+    
+    Returns:
+        Tuple of (model, features, serialized ONNX model or None)
+    """
     config = load_config()
     mlflow_config = config['mlflow']
     
     try:
-        # Try loading from MLflow
+        # Try loading from MLflow, reusing the local snapshot if it is still the latest version
         mlflow.set_tracking_uri(mlflow_config['tracking_uri'])
-        model = mlflow.sklearn.load_model(
-            model_uri=f"models:/nyc_taxi_trip_duration/latest"
-        )
-        features = config['model']['features']
-        return model, features
+        return load_mlflow_model(config['model']['model_dir'], config['model']['features'])
     except Exception as e:
         # Fallback to local model
         model_dir = config['model']['model_dir']
@@ -78,30 +134,101 @@ def load_model():
             try:
                 model = joblib.load(model_path)
                 features = joblib.load(feature_path) if os.path.exists(feature_path) else config['model']['features']
-                return model, features
+                return model, features, None
             except Exception as e:
                 st.sidebar.warning(f"Error loading model: {e}")
-                return None, None
+                return None, None, None
         else:
             # Model not found - return None but don't show error in sidebar (will show in main area)
-            return None, None
+            return None, None, None
+
+
+class OnnxPredictor:
+    """sklearn-style wrapper that predicts with an ONNX Runtime session"""
+    
+    def __init__(self, session, model):
+        self.session = session
+        self.model = model
+    
+    def predict(self, X):
+        return self.session.run(None, {'X': np.asarray(X, dtype=np.float32)})[0].ravel()
+
+
+def convert_to_onnx(model, n_features):
+    """
+    Convert a sklearn model to a serialized ONNX model
+    
+    Args:
+        model: Trained sklearn model
+        n_features: Number of input features
+        
+    Returns:
+        Serialized ONNX model, or None if skl2onnx is unavailable or conversion fails
+    """
+    try:
+        from skl2onnx import convert_sklearn
+        from skl2onnx.common.data_types import FloatTensorType
+    except ImportError:
+        logger.info("skl2onnx not installed. Predicting with sklearn.")
+        return None
+    
+    try:
+        onx = convert_sklearn(model, initial_types=[('X', FloatTensorType([None, n_features]))])
+        return onx.SerializeToString()
+    except Exception as e:
+        logger.warning(f"Could not convert model to ONNX: {e}. Predicting with sklearn.")
+        return None
+
+
+def to_onnx_predictor(model, onnx_model):
+    """Wrap a serialized ONNX model in an ONNX Runtime predictor, returning the sklearn model if unavailable"""
+    if onnx_model is None:
+        return model
+    
+    try:
+        import onnxruntime
+    except ImportError:
+        logger.info("onnxruntime not installed. Predicting with sklearn.")
+        return model
+    
+    try:
+        session = onnxruntime.InferenceSession(onnx_model, providers=['CPUExecutionProvider'])
+        return OnnxPredictor(session, model)
+    except Exception as e:
+        logger.warning(f"Could not load ONNX model: {e}. Predicting with sklearn.")
+        return model
+
+
+@st.cache_resource
+def load_model():
+    """Load the trained model (served through ONNX Runtime when available)"""
+    model, features, onnx_model = load_sklearn_model()
+    if model is None:
+        return None, None
+    if onnx_model is None:
+        # No persisted conversion (local model.joblib fallback, or conversion unavailable at snapshot time)
+        onnx_model = convert_to_onnx(model, len(features))
+    return to_onnx_predictor(model, onnx_model), features
+
+
+def get_feature_buffer(n_features):
+    """Get this session's reusable single-row float32 feature buffer"""
+    buf = st.session_state.get('feature_buffer')
+    if buf is None or buf.shape[1] != n_features:
+        buf = np.empty((1, n_features), dtype=np.float32)
+        st.session_state['feature_buffer'] = buf
+    return buf
 
 
 def predict_trip_duration(model, features, trip_data):
     """Make prediction"""
     try:
-        feature_values = [
-            trip_data['trip_distance'],
-            trip_data['passenger_count'],
-            trip_data['hour'],
-            trip_data['day_of_week'],
-            trip_data['month'],
-            trip_data['pickup_location_id'],
-            trip_data['dropoff_location_id']
-        ]
-        
-        X = pd.DataFrame([feature_values], columns=features)
-        prediction = model.predict(X)[0]
+        # Fill the buffer in the model's training feature order
+        X = get_feature_buffer(len(features))
+        X[0, :] = [trip_data[f] for f in features]
+        # Form widgets bound every input, so skip sklearn's finiteness scan
+        with sklearn.config_context(assume_finite=True):
+            prediction = model.predict(X)[0]
         return float(prediction)
     except Exception as e:
         st.error(f"Prediction error: {e}")
@@ -170,7 +297,10 @@ def show_home():
         st.metric("Features", len(features) if features else 7)
     
     with col3:
-        st.metric("Model Type", "Random Forest" if model is not None else "Random Forest")
+        if model is not None:
+            st.metric("Model Type", type(getattr(model, 'model', model)).__name__)
+        else:
+            st.metric("Model Type", "N/A")
     
     # Show helpful message if model not loaded
     if model is None:
@@ -276,7 +406,7 @@ def show_single_prediction(model, features):
         pickup_location_id = st.number_input(
             "Pickup Location ID",
             min_value=1,
-            max_value=300,
+            max_value=265,
             value=161,
             step=1
         )
@@ -284,7 +414,7 @@ def show_single_prediction(model, features):
         dropoff_location_id = st.number_input(
             "Dropoff Location ID",
             min_value=1,
-            max_value=300,
+            max_value=265,
             value=162,
             step=1
         )
@@ -340,8 +470,8 @@ def show_batch_prediction(model, features):
                 with col2:
                     day_of_week = st.number_input(f"Day of Week - Trip {i+1}", 0, 6, 1, key=f"day_{i}")
                     month = st.number_input(f"Month - Trip {i+1}", 1, 12, 6, key=f"month_{i}")
-                    pickup_id = st.number_input(f"Pickup ID - Trip {i+1}", 1, 300, 161, key=f"pick_{i}")
-                    dropoff_id = st.number_input(f"Dropoff ID - Trip {i+1}", 1, 300, 162, key=f"drop_{i}")
+                    pickup_id = st.number_input(f"Pickup ID - Trip {i+1}", 1, 265, 161, key=f"pick_{i}")
+                    dropoff_id = st.number_input(f"Dropoff ID - Trip {i+1}", 1, 265, 162, key=f"drop_{i}")
                 
                 trips.append({
                     'trip_distance': trip_distance,
@@ -354,13 +484,15 @@ def show_batch_prediction(model, features):
                 })
         
         if st.button("🚀 Predict All", type="primary"):
-            predictions = []
-            progress_bar = st.progress(0)
-            
-            for i, trip in enumerate(trips):
-                pred = predict_trip_duration(model, features, trip)
-                predictions.append(pred)
-                progress_bar.progress((i + 1) / len(trips))
+            # Predict all trips in a single call
+            X = np.asarray([[trip[f] for f in features] for trip in trips], dtype=np.float32)
+            try:
+                # Form widgets bound every input, so skip sklearn's finiteness scan
+                with sklearn.config_context(assume_finite=True):
+                    predictions = model.predict(X)
+            except Exception as e:
+                st.error(f"Prediction error: {e}")
+                return
             
             # Display results
             results_df = pd.DataFrame({
@@ -374,12 +506,38 @@ def show_batch_prediction(model, features):
     else:
         uploaded_file = st.file_uploader("Upload CSV file", type=['csv'])
         if uploaded_file:
-            df = pd.read_csv(uploaded_file)
+            try:
+                df = pd.read_csv(uploaded_file, dtype={f: 'float32' for f in features})
+            except ValueError as e:
+                st.error(f"Feature columns must be numeric: {e}")
+                return
             st.dataframe(df.head())
             
             if st.button("🚀 Predict", type="primary"):
-                # Process CSV and make predictions
-                st.info("CSV batch processing coming soon!")
+                missing = [f for f in features if f not in df.columns]
+                if missing:
+                    st.error(f"CSV is missing required columns: {', '.join(missing)}")
+                    return
+                
+                # Predict all rows in a single call
+                X = df[features].to_numpy(dtype=np.float32, copy=False)
+                
+                # Blank or infinite cells would otherwise yield plausible-looking predictions
+                bad_rows = np.flatnonzero(~np.isfinite(X).all(axis=1)) + 1
+                if len(bad_rows):
+                    shown = ', '.join(str(r) for r in bad_rows[:10])
+                    more = f" (and {len(bad_rows) - 10} more)" if len(bad_rows) > 10 else ""
+                    st.error(f"CSV rows with missing or non-finite feature values: {shown}{more}")
+                    return
+                
+                try:
+                    df['predicted_duration'] = model.predict(X)
+                except Exception as e:
+                    st.error(f"Prediction error: {e}")
+                    return
+                
+                st.dataframe(df, use_container_width=True)
+                st.metric("Average Duration", f"{df['predicted_duration'].mean():.2f} minutes")
 
 
 def show_model_info(model, features):
@@ -395,7 +553,7 @@ def show_model_info(model, features):
     
     with col1:
         st.markdown("### Model Details")
-        st.metric("Model Type", type(model).__name__)
+        st.metric("Model Type", type(getattr(model, 'model', model)).__name__)
         st.metric("Number of Features", len(features))
         st.metric("Model Status", "✅ Loaded")
     
@@ -459,7 +617,7 @@ def show_about():
     ```
     Data Ingestion → Train Model → Serve Predictions
                             ↓
-                    EvidentlyAI Monitor
+                    KS Drift Monitor
                             ↓
                     Drift Detected?
                             ↓
@@ -468,9 +626,9 @@ def show_about():
     
     ### 🛠️ Tech Stack
     
-    - **ML Framework**: scikit-learn (Random Forest)
+    - **ML Framework**: scikit-learn (HistGradientBoosting)
     - **Model Tracking**: MLflow
-    - **Drift Detection**: EvidentlyAI
+    - **Drift Detection**: Per-feature KS tests (EvidentlyAI for full reports)
     - **Orchestration**: Apache Airflow
     - **Web Interface**: Streamlit
     - **Data Source**: NYC Green Taxi Trip Data